@@ -5,10 +5,41 @@ import yaml
 import ldap
 import ldap.sasl
 import ldap.modlist
+import ldap.controls
+import ldap.dn
+import ldap.filter
 import textwrap
 import copy
+import collections
+import os
+import time
+import errno
+import hashlib
+import tempfile
+import urllib
+import stat
+import select
+import types
+import functools
+import itertools
+import array
+import sys
+import io
+import subprocess
 
 matching_rule_in_chain = ':1.2.840.113556.1.4.1941:'
+tree_delete_control = '1.2.840.113556.1.4.805'
+
+# command literals
+get    = 'get'
+search = 'search'
+create = 'create'
+delete = 'delete'
+insert = 'insert'
+remove = 'remove'
+members = 'members'
+membership = 'membership'
+analyze = 'analyze'
 
 def recursive_merge(a, b):
     """Merge nested dictionary objects. a will be merged into b"""
@@ -18,74 +49,546 @@ def recursive_merge(a, b):
         else:
             b[key] = a[key]
 
-def render_pretty_output(output):
-    black          = '\x1b[30m'
-    red            = '\x1b[31m'
-    green          = '\x1b[32m'
-    yellow         = '\x1b[33m'
-    blue           = '\x1b[34m'
-    magenta        = '\x1b[35m'
-    cyan           = '\x1b[36m'
-    white          = '\x1b[37m'
-    bright_black   = '\x1b[30;1m'
-    bright_red     = '\x1b[31;1m'
-    bright_green   = '\x1b[32;1m'
-    bright_yellow  = '\x1b[33;1m'
-    bright_blue    = '\x1b[34;1m'
-    bright_magenta = '\x1b[35;1m'
-    bright_cyan    = '\x1b[36;1m'
-    bright_white   = '\x1b[37;1m'
-    reset_color    = '\x1b[39;49m'
-
-    def print_header(value):
-        print white + query + reset_color + ':'
-
-    def print_divider():
-        print '-' * 40
-
-    def print_error(message):
-        print red + message + reset_color
-
-    def print_success():
-        print green + "Operation successful; no results" + reset_color
-
-    def print_single_attribute(key, values_list):
-        attribute = cyan + "%-18s" % key + reset_color + ': ' 
+def _buffered_writer(stream, size=1 << 16):
+    try:
+        fd = stream.fileno()
+    except (AttributeError, IOError, io.UnsupportedOperation):
+        return stream
+    stream.flush()
+    return io.BufferedWriter(io.FileIO(fd, 'w', closefd=False), size)
+
+def render_pretty_output(output, stream=None, color=None, page=False):
+    """
+    Render output in a colorful, human-readable format.  output is either
+    an output dictionary or an iterable of (query, result) pairs, as
+    produced by the stream option of LDAPAdminTool; the results of a
+    streamed result are consumed, and written, one entry at a time.
+    Everything is written through a single large buffered writer rather
+    than printed line by line.  Colors are used only when writing to a
+    terminal unless color is given.  If page is true and the output is a
+    terminal, it is shown through $PAGER (default: less -R).  Returns
+    True if every query was successful.
+    """
+    stream = stream or sys.stdout
+    is_tty = hasattr(stream, 'isatty') and stream.isatty()
+    if color is None:
+        color = is_tty
+
+    red         = '\x1b[31m' if color else ''
+    green       = '\x1b[32m' if color else ''
+    yellow      = '\x1b[33m' if color else ''
+    magenta     = '\x1b[35m' if color else ''
+    cyan        = '\x1b[36m' if color else ''
+    white       = '\x1b[37m' if color else ''
+    reset_color = '\x1b[39;49m' if color else ''
+
+    pager = None
+    if page and is_tty:
+        stream.flush()
+        pager = subprocess.Popen(os.environ.get('PAGER', 'less -R'),
+                                 shell=True, stdin=subprocess.PIPE)
+        stream = pager.stdin
+    out = _buffered_writer(stream)
+    write = out.write
+
+    divider = '-' * 40 + '\n'
+    none_value = magenta + 'None' + reset_color + '\n'
+    no_results = green + "Operation successful; no results" + \
+                 reset_color + '\n'
+
+    def write_single_attribute(key, values_list):
+        attribute = cyan + key.ljust(18) + reset_color + ': '
         if not values_list:
-            printable_value = magenta + 'None' + reset_color
-            print attribute + printable_value
+            write(attribute + none_value)
         else:
+            attribute += yellow
+            value_end = reset_color + '\n'
             for value in values_list:
-                printable_value = yellow + value + reset_color
-                print attribute + printable_value
+                write(attribute + value + value_end)
 
-    def print_object(obj):
-        print_divider()
+    def write_object(obj):
+        write(divider)
         for k, v in obj[1].items():
-            print_single_attribute(k, v)
-        print_divider()
-
-    def print_result(result):
-        if not result['success']:
-            print_error(result['message'])
-        elif not result['results']:
-            print_success()
-        else:
-            for r in result['results']:
-                print_object(r)
-
-    output_str_list = []
-    for query, result in output.items():
-        print_header(query)
-        print_result(result)
+            write_single_attribute(k, v)
+        write(divider)
+
+    def write_result(result):
+        success = result['success']
+        message = result['message']
+        written = False
+        results = iter(result['results'])
+        while True:
+            # a streamed result raises while it is consumed if it fails
+            try:
+                r = next(results)
+            except StopIteration:
+                break
+            except Exception as e:
+                success, message = False, e.__str__()
+                break
+            write_object(r)
+            written = True
+        if not success:
+            write(red + message + reset_color + '\n')
+        elif not written:
+            write(no_results)
+        return success
+
+    if isinstance(output, dict):
+        output = output.iteritems()
+    all_success = True
+    try:
+        for query, result in output:
+            write(white + query + reset_color + ':\n')
+            all_success = write_result(result) and all_success
+        out.flush()
+        if pager is not None:
+            pager.stdin.close()
+    except IOError as e:
+        # the pager was quit before all output was written
+        if pager is None or e.errno != errno.EPIPE:
+            raise
+    finally:
+        if pager is not None:
+            pager.wait()
+    return all_success
 
 def render_yaml_output(output):
     print yaml.dump(output)
 
+class PartialResultsError(RuntimeError):
+
+    """
+    Raised when an operation fails for some, but not all, of the entries
+    it acted upon.  The per-entry results are kept so that they can be
+    reported alongside the error message.
+    """
+
+    def __init__(self, message, results):
+        RuntimeError.__init__(self, message)
+        self.results = results
+
+class SkippedError(RuntimeError):
+
+    """
+    Reported for an entry that was not acted upon because an operation it
+    depends on failed.
+    """
+
 class auth():
     kerb, simple, noauth = "kerb_auth", "simple_auth", "no_auth"
 
-SCOPE=ldap.SCOPE_SUBTREE # hardcoded for now; to be moved to configuration
+SCOPE=ldap.SCOPE_SUBTREE # default scope of LDAPObjectManager queries
+
+scopes = {'base': ldap.SCOPE_BASE,
+          'one_level': ldap.SCOPE_ONELEVEL,
+          'subtree': ldap.SCOPE_SUBTREE}
+
+class Filter():
+
+    """
+    A node of a search filter tree.  The string form of every node is
+    built once, when the node is created, and reused from then on.
+    """
+
+    _string = ''
+
+    def __str__(self):
+        return self._string
+
+    def key(self):
+        return self._string
+
+    def split(self, max_terms, max_length):
+        return [self]
+
+    def chunks(self, max_terms, max_length):
+        return [self._string]
+
+class RawFilter(Filter):
+
+    """
+    A filter supplied as a string, for instance by configuration.  It is
+    used as is, apart from adding the surrounding parentheses if missing.
+    """
+
+    def __init__(self, string):
+        string = string.strip()
+        if string and not (string.startswith('(') and string.endswith(')')):
+            string = '(%s)' % string
+        self._string = string
+
+class Term(Filter):
+
+    """
+    An attribute value assertion, such as (cn=alice).  The value is
+    escaped as described in RFC 4515.  rule is an optional matching rule
+    such as matching_rule_in_chain, and suffix is appended unescaped,
+    for instance '*' for a substring match.
+    """
+
+    def __init__(self, attr, value, rule='', suffix=''):
+        if not isinstance(value, basestring):
+            value = str(value)
+        value = ldap.filter.escape_filter_chars(value) + suffix
+        self._string = '(%s%s=%s)' %(attr, rule, value)
+        self._key = (attr.lower(), rule, value)
+
+    def key(self):
+        return self._key
+
+class Compound(Filter):
+
+    """
+    An AND ('&') or OR ('|') of other filters.  Children with the same
+    operator are flattened into this filter, and duplicate or empty
+    children are dropped.  A compound with a single child has the string
+    form of that child.  Large ORs can be split into chunks of at most
+    max_terms terms and max_length characters, so that they do not exceed
+    the limits of the server.
+    """
+
+    def __init__(self, op, *filters):
+        self.op = op
+        self.filters = []
+        seen = set()
+        for f in filters:
+            if not isinstance(f, Filter):
+                f = RawFilter(f)
+            if isinstance(f, Compound) and f.op == op:
+                children = f.filters
+            else:
+                children = [f]
+            for c in children:
+                if str(c) and c.key() not in seen:
+                    seen.add(c.key())
+                    self.filters.append(c)
+        if len(self.filters) == 1:
+            self._string = str(self.filters[0])
+        elif self.filters:
+            self._string = '(%s%s)' %(op, ''.join([str(f) \
+                                                   for f in self.filters]))
+        self._key = (op, tuple([f.key() for f in self.filters]))
+
+    def key(self):
+        return self._key
+
+    def split(self, max_terms, max_length):
+        if self.op == '|':
+            groups = [[]]
+            length = 0
+            for f in self.filters:
+                if groups[-1] and (len(groups[-1]) >= max_terms or \
+                                   length + len(str(f)) > max_length):
+                    groups.append([])
+                    length = 0
+                groups[-1].append(f)
+                length += len(str(f))
+            if len(groups) == 1:
+                return [self]
+            return [Compound('|', *g) for g in groups]
+        # an AND is split by distributing it over the parts of the child
+        # that splits into the most parts
+        parts = [f.split(max_terms, max_length) for f in self.filters]
+        if not parts or max([len(p) for p in parts]) == 1:
+            return [self]
+        i = max(range(len(parts)), key=lambda i: len(parts[i]))
+        others = self.filters[:i] + self.filters[i + 1:]
+        return [Compound('&', p, *others) for p in parts[i]]
+
+    def chunks(self, max_terms, max_length):
+        """
+        Return the string forms of filters that, together, match the same
+        entries as this filter.
+        """
+        return [str(f) for f in self.split(max_terms, max_length)]
+
+class MemoryResultCache():
+
+    """
+    A size-bounded, least-recently-used result cache held in the memory
+    of the current process.  Keys are tuples whose first two items are
+    the object type and command of the query.
+    """
+
+    def __init__(self, size=1024):
+        self._size = size
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] < time.time():
+            return None
+        self._entries[key] = entry
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, value, ttl):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time() + ttl, copy.deepcopy(value))
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+
+    def evict(self, types=(), commands=()):
+        for key in [k for k in self._entries \
+                    if k[0] in types or k[1] in commands]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+class DiskResultCache():
+
+    """
+    A size-bounded result cache stored as one file per key beneath a
+    directory, so that it can be shared by every ldapadm process run by
+    the same user.  Files are written atomically and the least recently
+    used files are removed once the cache grows beyond its size.  The
+    directory is only listed once per process to count the files, and
+    again when pruning, which removes a tenth of the files at once.
+    Results are stored as YAML, and a directory that other users could
+    write to is refused.
+    """
+
+    def __init__(self, path, size=1024):
+        self._root = os.path.expanduser(path)
+        self._size = size
+        self._count = None
+        self._check_root()
+
+    def _check_root(self):
+        if not os.path.isdir(self._root):
+            os.makedirs(self._root, 0o700)
+        st = os.stat(self._root)
+        if st.st_uid != os.getuid() or \
+                st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError("Cache directory '%s' must be owned by the "
+                             "current user and not writable by others"
+                             % self._root)
+
+    def _type_dir(self, item_type):
+        return os.path.join(self._root, urllib.quote(str(item_type), safe=''))
+
+    def _path(self, key):
+        return os.path.join(self._type_dir(key[0]), '%s-%s' \
+            %(key[1], hashlib.sha1(repr(key)).hexdigest()))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, expires, value = yaml.safe_load(f)
+        except (IOError, ValueError, TypeError, yaml.YAMLError):
+            return None
+        if stored_key != repr(key) or expires < time.time():
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            # removed by another process in the meantime
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            yaml.safe_dump([repr(key), time.time() + ttl, value], f)
+        is_new = not os.path.exists(path)
+        os.rename(tmp_path, path)
+        if self._count is None:
+            self._count = len(self._entries())
+        elif is_new:
+            self._count += 1
+        if self._count > self._size:
+            self._prune()
+
+    def _entries(self):
+        entries = []
+        for directory, subdirs, files in os.walk(self._root):
+            for f in files:
+                path = os.path.join(directory, f)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        return entries
+
+    def _prune(self):
+        entries = sorted(self._entries())
+        keep = self._size - self._size // 10
+        for mtime, path in entries[:max(len(entries) - keep, 0)]:
+            self._remove(path)
+        self._count = min(len(entries), keep)
+
+    def evict(self, types=(), commands=()):
+        for mtime, path in self._entries():
+            item_dir = os.path.basename(os.path.dirname(path))
+            command = os.path.basename(path).split('-', 1)[0]
+            if item_dir in [urllib.quote(str(t), safe='') for t in types] \
+                    or command in commands:
+                self._remove(path)
+        self._count = None
+
+    def clear(self):
+        for mtime, path in self._entries():
+            self._remove(path)
+        self._count = None
+
+class MembershipMatrix():
+
+    """
+    An integer-indexed sparse matrix of group membership.  Every DN is
+    interned to an integer id, and each group is a row whose member ids
+    are stored in compressed sparse row form: the sorted members of row r
+    are indices[indptr[r]:indptr[r + 1]].  Set-valued questions are
+    answered with bulk set operations over these slices.
+    """
+
+    def __init__(self):
+        self.dns = []
+        self._ids = {}
+        self.group_ids = array.array('l')
+        self._rows = {}
+        self._names = {}
+        self.indptr = array.array('l', [0])
+        self.indices = array.array('l')
+        self.users = None
+
+    def intern(self, dn):
+        key = dn.lower()
+        i = self._ids.get(key)
+        if i is None:
+            i = self._ids[key] = len(self.dns)
+            self.dns.append(dn)
+        return i
+
+    def add_group(self, dn, name, member_dns):
+        i = self.intern(dn)
+        self._rows[i] = len(self.group_ids)
+        self._names[name.lower()] = len(self.group_ids)
+        self.group_ids.append(i)
+        self.indices.extend(sorted(set(self.intern(m) for m in member_dns)))
+        self.indptr.append(len(self.indices))
+
+    def set_users(self, dns):
+        self.users = array.array('l', sorted(set(self.intern(d) \
+                                                 for d in dns)))
+
+    def row(self, name):
+        r = self._names.get(name.lower())
+        if r is None:
+            raise RuntimeError("No group named '%s' was loaded" % name)
+        return r
+
+    def members(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def sizes(self):
+        return array.array('l', (b - a for a, b in \
+            itertools.izip(self.indptr, itertools.islice(self.indptr, 1,
+                                                          None))))
+
+    def intersection(self, rows):
+        rows = sorted(rows, key=lambda r: self.indptr[r + 1] - self.indptr[r])
+        result = set(self.members(rows[0]))
+        for r in rows[1:]:
+            result.intersection_update(self.members(r))
+        return sorted(result)
+
+    def union(self, rows):
+        return sorted(set().union(*[self.members(r) for r in rows]))
+
+    def orphans(self):
+        return [self.group_ids[r] for r, size in enumerate(self.sizes()) \
+                if size == 0]
+
+    def _parents(self):
+        parents = [[] for r in self.group_ids]
+        for r in xrange(len(self.group_ids)):
+            for m in self.members(r):
+                child = self._rows.get(m)
+                if child is not None:
+                    parents[child].append(r)
+        return parents
+
+    def depths(self):
+        """
+        Return the nesting depth of every row: 0 for a group without
+        nested groups, otherwise one more than its deepest nested group.
+        Membership cycles are cut where they are first found.
+        """
+        depth = array.array('l', [-1] * len(self.group_ids))
+        for root in xrange(len(self.group_ids)):
+            if depth[root] >= 0:
+                continue
+            on_stack = set([root])
+            stack = [(root, iter(self.members(root)))]
+            while stack:
+                r, children = stack[-1]
+                for m in children:
+                    child = self._rows.get(m)
+                    if child is not None and depth[child] < 0 \
+                            and child not in on_stack:
+                        on_stack.add(child)
+                        stack.append((child, iter(self.members(child))))
+                        break
+                else:
+                    stack.pop()
+                    on_stack.discard(r)
+                    depth[r] = max([depth[self._rows[m]] + 1 \
+                                    for m in self.members(r) \
+                                    if m in self._rows \
+                                    and depth[self._rows[m]] >= 0] or [0])
+        return depth
+
+    def effective_counts(self):
+        """
+        Return a mapping of user id to the number of groups the user is a
+        member of, directly or through nested groups.  Only loaded users
+        are counted, or every non-group member if no users were loaded.
+        """
+        parents = self._parents()
+        ancestors = {}
+        def ancestors_of(row):
+            result = ancestors.get(row)
+            if result is None:
+                ancestors[row] = frozenset([row])
+                found = set([row])
+                stack = [row]
+                while stack:
+                    for p in parents[stack.pop()]:
+                        if p not in found:
+                            found.add(p)
+                            stack.append(p)
+                result = ancestors[row] = frozenset(found)
+            return result
+        direct = collections.defaultdict(list)
+        for r in xrange(len(self.group_ids)):
+            for m in self.members(r):
+                if m not in self._rows:
+                    direct[m].append(r)
+        users = self.users if self.users is not None else sorted(direct)
+        counts = {}
+        for u in users:
+            rows = direct.get(u)
+            if not rows:
+                counts[u] = 0
+            elif len(rows) == 1:
+                counts[u] = len(ancestors_of(rows[0]))
+            else:
+                counts[u] = len(frozenset().union(*[ancestors_of(r) \
+                                                   for r in rows]))
+        return counts
 
 class LDAPObjectManager():
 
@@ -95,26 +598,162 @@ class LDAPObjectManager():
 
     LDAPObjectManager accepts keyword arguments that are passed on to
     the underlying LDAP object.
+
+    timeout limits the time any single operation may take and
+    network_timeout the time taken to connect, both in seconds.  When an
+    operation fails because the connection was lost or stalled, the
+    connection is dropped, and the next operation reconnects and rebinds.
+    Reads are then retried up to retries times, waiting retry_delay
+    seconds before the first retry and twice as long before each one
+    after it.  Writes are never replayed, since the server may already
+    have applied them.  If hedge_uri is given, a read that has not
+    completed within hedge_delay seconds is issued again to that server,
+    and whichever answer arrives first is used.
     """
 
-    def __init__(self, uri, authtype, user=None, password=None, **kwargs):
+    transient_errors = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT,
+                        ldap.BUSY, ldap.UNAVAILABLE)
+    connection_errors = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT)
+
+    # python-ldap 3 reports the message id of a failed operation in its
+    # error, so that the results of any operation can be polled at once
+    reports_msgid = not ldap.__version__.startswith('2.')
+
+    def __init__(self, uri, authtype, user=None, password=None, timeout=None,
+                 network_timeout=None, retries=0, retry_delay=0.5,
+                 hedge_uri=None, hedge_delay=0.5, **kwargs):
         # not sure that I like hardcoding the list of supported auth types...
         if not authtype in [auth.kerb, auth.simple, auth.noauth]:
             raise ValueError("'%s' is not a supported authentication method" \
                              % authtype)
-        self._ldo = ldap.initialize(uri)
-        for key, value in kwargs.items():
-            self._ldo.set_option(getattr(ldap, key), value)
-        if authtype == auth.simple:
-            self._ldo.simple_bind_s(user, password)
-        elif authtype == auth.kerb:
-            self._ldo.sasl_interactive_bind_s('', ldap.sasl.gssapi())
+        self._uri = uri
+        self._authtype = authtype
+        self._user = user
+        self._password = password
+        self._options = kwargs
+        self._timeout = -1 if timeout is None else timeout
+        self._network_timeout = network_timeout
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._hedge_uri = hedge_uri
+        self._hedge_delay = hedge_delay
+        self._hedge_ldo = None
+        # incremented whenever the connection is dropped; message ids from
+        # an earlier generation will never complete
+        self.generation = 0
+        self._ldo = self._connect(uri)
+
+    def _connect(self, uri):
+        ldo = ldap.initialize(uri)
+        for key, value in self._options.items():
+            ldo.set_option(getattr(ldap, key), value)
+        if self._network_timeout is not None:
+            ldo.set_option(ldap.OPT_NETWORK_TIMEOUT, self._network_timeout)
+        ldo.timeout = self._timeout
+        if self._authtype == auth.simple:
+            ldo.simple_bind_s(self._user, self._password)
+        elif self._authtype == auth.kerb:
+            ldo.sasl_interactive_bind_s('', ldap.sasl.gssapi())
+        return ldo
+
+    def _connection(self):
+        if self._ldo is None:
+            self._ldo = self._connect(self._uri)
+        return self._ldo
+
+    def _drop_connection(self):
+        ldo, self._ldo = self._ldo, None
+        if ldo is not None:
+            self.generation += 1
+            try:
+                ldo.unbind_ext()
+            except ldap.LDAPError:
+                pass
+
+    def _call(self, idempotent, function, *args, **kwargs):
+        """
+        Call function with the current connection and the remaining
+        arguments, reconnecting and retrying as described above.
+        """
+        attempt = 0
+        while True:
+            try:
+                return function(self._connection(), *args, **kwargs)
+            except self.transient_errors as e:
+                if isinstance(e, self.connection_errors):
+                    self._drop_connection()
+                if not idempotent or attempt >= self._retries:
+                    raise
+                time.sleep(self._retry_delay * 2 ** attempt)
+                attempt += 1
+
+    def _search_s(self, ldo, sbase, scope, sfilter, attrs):
+        if self._hedge_uri is None:
+            return ldo.search_ext_s(sbase, scope, sfilter, attrlist=attrs,
+                                    timeout=self._timeout)
+        msgid = ldo.search_ext(sbase, scope, sfilter, attrlist=attrs)
+        try:
+            rtype, rdata, rmsgid, serverctrls = ldo.result3(msgid, 1,
+                                                            self._hedge_delay)
+            if rtype is not None:
+                return rdata
+        except ldap.TIMEOUT:
+            pass
+        candidates = [(ldo, msgid)]
+        try:
+            if self._hedge_ldo is None:
+                self._hedge_ldo = self._connect(self._hedge_uri)
+            candidates.append((self._hedge_ldo, self._hedge_ldo.search_ext(
+                sbase, scope, sfilter, attrlist=attrs)))
+        except self.transient_errors:
+            self._hedge_ldo = None
+        return self._first_result(candidates)
+
+    def _first_result(self, candidates):
+        if self._timeout >= 0:
+            deadline = time.time() + self._timeout - self._hedge_delay
+        else:
+            deadline = None
+        while True:
+            for candidate in list(candidates):
+                conn, msgid = candidate
+                try:
+                    rtype, rdata, rmsgid, serverctrls = conn.result3(msgid,
+                                                                     1, 0)
+                except self.transient_errors:
+                    if conn is self._ldo or len(candidates) == 1:
+                        for other, other_msgid in candidates:
+                            if other is not conn:
+                                self._abandon_quietly(other, other_msgid)
+                        raise
+                    self._hedge_ldo = None
+                    candidates.remove(candidate)
+                    continue
+                if rtype is not None:
+                    for other, other_msgid in candidates:
+                        if other is not conn:
+                            other.abandon_ext(other_msgid)
+                    return rdata
+            wait = 0.05
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    for conn, msgid in candidates:
+                        conn.abandon_ext(msgid)
+                    raise ldap.TIMEOUT({'desc': 'Timed out'})
+            select.select([c.get_option(ldap.OPT_DESC) \
+                           for c, m in candidates], [], [], wait)
+
+    def _abandon_quietly(self, ldo, msgid):
+        try:
+            ldo.abandon_ext(msgid)
+        except ldap.LDAPError:
+            pass
 
     def _strip_references(self, ldif):
         return [x for x in ldif if x[0] is not None]
 
-    def get_single(self, sbase, sfilter, scope=SCOPE, attrs=None):
-        ldif = self._ldo.search_ext_s(sbase, scope, sfilter, attrlist=attrs)
+    def single_result(self, ldif, sbase, sfilter):
         result = self._strip_references(ldif)
         if not result:
             raise RuntimeError(textwrap.dedent("""\
@@ -129,32 +768,215 @@ class LDAPObjectManager():
                                results: '%s'""" %(sbase, sfilter, result)))
         return result[0]
 
+    def multiple_result(self, ldif):
+        return self._strip_references(ldif)
+
+    def get_single(self, sbase, sfilter, scope=SCOPE, attrs=None):
+        ldif = self._call(True, self._search_s, sbase, scope, sfilter, attrs)
+        return self.single_result(ldif, sbase, sfilter)
+
     def get_multiple(self, sbase, sfilter, scope=SCOPE, attrs=None):
-        return self._strip_references(self._ldo.search_ext_s(sbase, scope,
-            sfilter, attrlist=attrs))
+        return self.multiple_result(self._call(True, self._search_s, sbase,
+                                               scope, sfilter, attrs))
 
-    def add_attribute(self, sbase, dn, attr, *values):
-        oldobj = self.get_single(dn, 'objectClass=*')[1]
+    def add_values_modlist(self, oldobj, attr, *values):
         newobj = copy.deepcopy(oldobj)
         newobj[attr] = newobj.get(attr, []) + list(values)
-        ml = ldap.modlist.modifyModlist(oldobj, newobj)
-        self._ldo.modify_ext_s(dn, ml)
+        return ldap.modlist.modifyModlist(oldobj, newobj)
 
-    def remove_attribute(self, sbase, dn, attr, *values):
-        oldobj = self.get_single(dn, 'objectClass=*')[1]
+    def remove_values_modlist(self, oldobj, attr, *values):
         newobj = copy.deepcopy(oldobj)
         for v in values:
             newobj[attr].remove(v)
-        ml = ldap.modlist.modifyModlist(oldobj, newobj)
-        self._ldo.modify_ext_s(dn, ml)
+        return ldap.modlist.modifyModlist(oldobj, newobj)
 
-    def create_object(self, dn, attrs):
+    def add_attribute(self, sbase, dn, attr, *values):
+        oldobj = self.get_single(dn, 'objectClass=*', scope=ldap.SCOPE_BASE,
+                                 attrs=[attr])[1]
+        ml = self.add_values_modlist(oldobj, attr, *values)
+        self._call(False, lambda ldo: ldo.modify_ext_s(dn, ml))
+
+    def remove_attribute(self, sbase, dn, attr, *values):
+        oldobj = self.get_single(dn, 'objectClass=*', scope=ldap.SCOPE_BASE,
+                                 attrs=[attr])[1]
+        ml = self.remove_values_modlist(oldobj, attr, *values)
+        self._call(False, lambda ldo: ldo.modify_ext_s(dn, ml))
+
+    def _add_modlist(self, attrs):
         if not attrs:
             raise ValueError("New objects must have at least one attribute")
-        self._ldo.add_ext_s(dn, ldap.modlist.addModlist(attrs))
+        return ldap.modlist.addModlist(attrs)
+
+    def create_object(self, dn, attrs):
+        ml = self._add_modlist(attrs)
+        self._call(False, lambda ldo: ldo.add_ext_s(dn, ml))
 
     def delete_object(self, dn):
-        self._ldo.delete_ext_s(dn)
+        self._call(False, lambda ldo: ldo.delete_ext_s(dn))
+
+    # The *_async methods start an operation without waiting for it and
+    # return its message id.  Results are collected with poll_result().
+    # Neither is retried, but both drop a failed connection so that the
+    # next operation reconnects.
+
+    def _start(self, function, *args, **kwargs):
+        try:
+            return function(self._connection(), *args, **kwargs)
+        except self.connection_errors:
+            self._drop_connection()
+            raise
+
+    def search_async(self, sbase, sfilter, scope=SCOPE, attrs=None):
+        return self._start(lambda ldo: ldo.search_ext(sbase, scope, sfilter,
+                                                      attrlist=attrs))
+
+    def modify_async(self, dn, ml):
+        return self._start(lambda ldo: ldo.modify_ext(dn, ml))
+
+    def create_object_async(self, dn, attrs):
+        ml = self._add_modlist(attrs)
+        return self._start(lambda ldo: ldo.add_ext(dn, ml))
+
+    def delete_object_async(self, dn):
+        return self._start(lambda ldo: ldo.delete_ext(dn))
+
+    def poll_result(self, msgid):
+        """
+        Return the result data of the operation with the given message id,
+        or None if it has not completed yet.  Never blocks.  Raises the
+        corresponding LDAPError if the operation failed.
+        """
+        rtype, rdata, rmsgid, serverctrls = self._start(
+            lambda ldo: ldo.result3(msgid, 1, 0))
+        if rtype is None:
+            return None
+        return rdata or []
+
+    def poll_any(self):
+        """
+        Return (message id, result data) of any one completed operation,
+        or None if none has completed.  Never blocks.  Raises the
+        corresponding LDAPError if the operation failed; the message id
+        is then its 'msgid' item, if reports_msgid is true.
+        """
+        rtype, rdata, rmsgid, serverctrls = self._start(
+            lambda ldo: ldo.result3(ldap.RES_ANY, 1, 0))
+        if rtype is None:
+            return None
+        return rmsgid, rdata or []
+
+    def fileno(self):
+        return self._connection().get_option(ldap.OPT_DESC)
+
+    def supports_control(self, oid):
+        root_dse = self.get_multiple('', '(objectClass=*)',
+            scope=ldap.SCOPE_BASE, attrs=['supportedControl'])
+        if not root_dse:
+            return False
+        for key, values in root_dse[0][1].items():
+            if key.lower() == 'supportedcontrol':
+                return oid in values
+        return False
+
+    def _search_page(self, ldo, sbase, scope, sfilter, attrs, page):
+        msgid = ldo.search_ext(sbase, scope, sfilter, attrlist=attrs,
+                               serverctrls=[page])
+        rtype, rdata, rmsgid, serverctrls = ldo.result3(msgid)
+        return rdata, serverctrls
+
+    def iter_paged(self, sbase, sfilter, scope=SCOPE, attrs=None,
+                   page_size=500):
+        # not critical: a server that cannot page returns every entry at
+        # once without a cookie, which ends the loop below
+        page = ldap.controls.SimplePagedResultsControl(False, size=page_size,
+                                                       cookie='')
+        while True:
+            # a paging cookie is only valid on the connection that issued
+            # it, so only the first page can be retried after a reconnect
+            rdata, serverctrls = self._call(not page.cookie,
+                self._search_page, sbase, scope, sfilter, attrs, page)
+            for entry in self._strip_references(rdata):
+                yield entry
+            cookies = [c.cookie for c in serverctrls \
+                       if c.controlType == page.controlType]
+            if not cookies or not cookies[0]:
+                return
+            page.cookie = cookies[0]
+
+    def _wait_for_delete(self, ldo, dn, msgid):
+        try:
+            ldo.result3(msgid)
+        except ldap.LDAPError as e:
+            if isinstance(e, self.connection_errors):
+                self._drop_connection()
+            return (dn, e)
+        return (dn, None)
+
+    def _delete_concurrently(self, dns, max_in_flight):
+        status = []
+        in_flight = collections.deque()
+        for dn in dns:
+            try:
+                ldo = self._connection()
+                in_flight.append((ldo, dn, ldo.delete_ext(dn)))
+            except ldap.LDAPError as e:
+                # keep draining the operations already issued, so that
+                # every entry is reported
+                if isinstance(e, self.connection_errors):
+                    self._drop_connection()
+                status.append((dn, e))
+                continue
+            if len(in_flight) >= max_in_flight:
+                status.append(self._wait_for_delete(*in_flight.popleft()))
+        while in_flight:
+            status.append(self._wait_for_delete(*in_flight.popleft()))
+        return status
+
+    def delete_subtree(self, dn, page_size=500, max_in_flight=16):
+        """
+        Delete dn and every entry beneath it.  If the server supports the
+        Tree Delete control, the whole subtree is removed by a single
+        operation.  Otherwise the subtree is paged through and deleted
+        leaf-first, one depth level at a time, with at most max_in_flight
+        delete operations outstanding.  The entries above one that could
+        not be deleted are skipped.  Returns a list of (dn, error) tuples,
+        where error is None for entries deleted successfully and a
+        SkippedError for entries skipped.
+        """
+        if self.supports_control(tree_delete_control):
+            control = ldap.controls.LDAPControl(tree_delete_control, True)
+            self._call(False, lambda ldo: ldo.delete_ext_s(dn,
+                serverctrls=[control]))
+            return [(dn, None)]
+        levels = {}
+        for entry in self.iter_paged(dn, '(objectClass=*)',
+                scope=ldap.SCOPE_SUBTREE, attrs=['1.1'], page_size=page_size):
+            depth = len(ldap.dn.explode_dn(entry[0]))
+            levels.setdefault(depth, []).append(entry[0])
+        status = []
+        # parents of entries that were not deleted, mapped to the entry
+        # whose failure keeps them from being deleted
+        blocked = {}
+        for depth in sorted(levels, reverse=True):
+            dns = []
+            for entry_dn in levels[depth]:
+                cause = blocked and blocked.get(self._dn_key(entry_dn))
+                if not cause:
+                    dns.append(entry_dn)
+                    continue
+                status.append((entry_dn, SkippedError("Not deleted because "
+                    "'%s' beneath it could not be deleted" % cause)))
+                blocked[self._dn_key(entry_dn, parent=True)] = cause
+            for entry_dn, error in self._delete_concurrently(dns,
+                                                             max_in_flight):
+                status.append((entry_dn, error))
+                if error is not None:
+                    blocked[self._dn_key(entry_dn, parent=True)] = entry_dn
+        return status
+
+    def _dn_key(self, dn, parent=False):
+        rdns = ldap.dn.explode_dn(dn)
+        return ','.join(rdns[1:] if parent else rdns).lower()
 
 class LDAPAdminTool():
 
@@ -180,8 +1002,16 @@ class LDAPAdminTool():
             lom_kwargs['user'] = self._config_get('username')
             lom_kwargs['password'] = self._config_get('password')
         self._lom = LDAPObjectManager(self._config_get('uri'),
-                                      auth_type,
-                                      **lom_kwargs)
+            auth_type,
+            timeout=self._config_get('timeout'),
+            network_timeout=self._config_get('network_timeout'),
+            retries=self._config_get('retries', default=2),
+            retry_delay=self._config_get('retry_delay', default=0.5),
+            hedge_uri=self._config_get('hedge_uri'),
+            hedge_delay=self._config_get('hedge_delay', default=0.5),
+            **lom_kwargs)
+        self._cache = self._build_cache(self._config_get('cache'))
+        self._filter_cache = {}
 
     def _config_get(self, *args, **kwargs):
         default = kwargs.get('default')
@@ -191,31 +1021,114 @@ class LDAPAdminTool():
             cursor = cursor.get(a, default)
         return cursor
 
-    def _join_filter(self, char, *filters):
-        if len(filters) == 0:
-            return ''
-        if len(filters) == 1:
-            return filters[0]
-        else:
-            def strip_parens(f):
-                return f[1:-1] if f.endswith(')') and f.startswith('(') else f
-            filters = map(strip_parens, filters)
-            return '(%s%s)' %(char, ''.join(['(%s)' % f for f in filters]))
-
-    def _join_and_filter(self, *filters):
-        return self._join_filter('&', *filters)
+    def _build_cache(self, cache_config):
+        if not isinstance(cache_config, dict):
+            return None
+        size = cache_config.get('size', 1024)
+        backend = cache_config.get('backend', 'disk')
+        if backend == 'memory':
+            return MemoryResultCache(size)
+        elif backend == 'disk':
+            return DiskResultCache(cache_config.get('path',
+                                                    '~/.cache/ldapadm'), size)
+        raise ValueError("'%s' is not a supported cache backend" % backend)
+
+    # type options that change which objects a query returns
+    query_options = ('base', 'scope', 'filter', 'identifier', 'search',
+                     'member', 'memberOf', 'member_matching_rule_in_chain',
+                     'member_of_matching_rule_in_chain')
+
+    def _cache_key(self, command, name, item_type, **kwargs):
+        types = [item_type] + [v for k, v in sorted(kwargs.items())]
+        display = tuple(tuple(self._config_get(t, 'display') or ()) \
+                        for t in types)
+        # results from another server, bind identity or query configuration
+        # must never be served, even from a cache directory shared by them
+        context = [self._config_get(o) for o in ('uri', 'base', 'auth_type',
+                                                 'username')]
+        context += [[self._config_get(t, o) for o in self.query_options] \
+                    for t in types]
+        return (item_type, command, name, display,
+                tuple(sorted(kwargs.items())),
+                hashlib.sha1(repr(context)).hexdigest())
+
+    def _caching(self):
+        return self._cache is not None and \
+               not self._config_get('cache', 'bypass')
+
+    def _cached(self, command, function):
+        if not self._caching():
+            return function
+        def cached_function(name, item_type, **kwargs):
+            key = self._cache_key(command, name, item_type, **kwargs)
+            results = self._cache.get(key)
+            if results is None:
+                results = function(name, item_type, **kwargs)
+                ttl = self._config_get(item_type, 'cache_ttl',
+                    default=self._config_get('cache', 'ttl', default=60))
+                self._cache.set(key, results, ttl)
+            return results
+        return cached_function
+
+    def _evict(self, *item_types):
+        # membership queries of any type may include the objects written to
+        if self._cache is not None:
+            self._cache.evict(types=item_types,
+                              commands=(members, membership))
+
+    def _clear_cache(self):
+        if self._cache is not None:
+            self._cache.clear()
+
+    def _written(self, output, evict):
+        """
+        Call evict, which removes the cached results a write command may
+        have changed, once the command has completed, and return output.
+        """
+        evict()
+        return output
 
-    def _join_or_filter(self, *filters):
-        return self._join_filter('|', *filters)
+    def _build_search_filter(self, fields, values, suffix=''):
+        return Compound('|', *[Term(f, v, suffix=suffix) for v in values \
+                               for f in fields or []])
+
+    def _filter_chunks(self, search_filter):
+        # filter trees are rebuilt for every query, so the chunks of equal
+        # filters are shared through their keys
+        limits = (self._config_get('max_filter_terms', default=500),
+                  self._config_get('max_filter_length', default=65536))
+        key = (search_filter.key(), limits)
+        if key not in self._filter_cache:
+            if len(self._filter_cache) >= 1024:
+                self._filter_cache.clear()
+            self._filter_cache[key] = search_filter.chunks(*limits)
+        return self._filter_cache[key]
+
+    def _merge_results(self, result_lists):
+        # entries matched by more than one chunk of a filter appear once
+        seen = set()
+        merged = []
+        for results in result_lists:
+            for r in results:
+                if r[0].lower() not in seen:
+                    seen.add(r[0].lower())
+                    merged.append(r)
+        return merged
+
+    def _scope(self, item_type):
+        scope = self._config_get(item_type, 'scope', default='subtree')
+        if scope not in scopes:
+            raise ValueError("'%s' is not a supported scope" % scope)
+        return scopes[scope]
+
+    def _single_query(self, item_type, search_term):
+        return (self._config_get(item_type, 'base'),
+            str(Term(self._config_get(item_type, 'identifier'), search_term)),
+            self._scope(item_type))
 
-    def _build_search_filter(self, fields, values):
-        return self._join_or_filter(*["(%s=%s)" % (f, v) for v in values \
-                                  for f in fields])
-    
     def _get_single(self, item_type, search_term, attrs=None):
-        return self._lom.get_single(self._config_get(item_type, 'base'),
-            "%s=%s" %(self._config_get(item_type, 'identifier'), search_term),
-            attrs=attrs)
+        sbase, sfilter, scope = self._single_query(item_type, search_term)
+        return self._lom.get_single(sbase, sfilter, scope=scope, attrs=attrs)
 
     def _add_missing_attributes(self, object, item_type):
         for attr in self._config_get(item_type, 'display', default=[]):
@@ -224,54 +1137,163 @@ class LDAPAdminTool():
                 object[1][attr] = None
 
     def _get_dn(self, item_type, name):
-        return self._get_single(item_type, name)[0]
+        # '1.1' requests no attributes at all
+        return self._get_single(item_type, name, attrs=['1.1'])[0]
+
+    def _get_dns(self, item_type, names):
+        """
+        Look up the DNs of many objects of item_type with as few queries
+        as the filter limits allow.  Returns a mapping of (item_type, name)
+        to DN for every name that matched exactly one object; the other
+        names are left to _get_dn, which reports why they did not match.
+        """
+        if not names:
+            return {}
+        identifier = self._config_get(item_type, 'identifier')
+        search_filter = Compound('|', *[Term(identifier, n) for n in names])
+        matches = {}
+        for chunk in self._filter_chunks(search_filter):
+            for dn, attrs in self._lom.get_multiple(
+                    self._config_get(item_type, 'base'), chunk,
+                    scope=self._scope(item_type), attrs=[identifier]):
+                for value in self._attribute_values(attrs, identifier):
+                    matches.setdefault(value.lower(), []).append(dn)
+        return dict(((item_type, n), matches[n.lower()][0]) for n in names \
+                    if len(matches.get(n.lower(), [])) == 1)
+
+    def _prefetch_dns(self, *lookups):
+        known_dns = {}
+        for item_type, names in lookups:
+            # a single name is looked up on its own anyway
+            if len(names) < 2:
+                continue
+            try:
+                known_dns.update(self._get_dns(item_type, names))
+            except ldap.LDAPError:
+                # every name is looked up on its own instead
+                pass
+        return known_dns
 
     def _generate_dn(self, item_type, name):
         return'%s=%s,%s' %(self._config_get(item_type, 'identifier'),
                            name,
                            self._config_get(item_type, 'base'))
 
-    def _search_for_objects_of_type(self, object_type, search_filter):
+    def _objects_of_type_query(self, object_type, search_filter):
         base = self._config_get(object_type, 'base',
             default=self._config_get('base'))
         object_filter = self._config_get(object_type, 'filter')
-        if object_filter:
-            search_filter = self._join_and_filter(search_filter, object_filter)
+        search_filter = Compound('&', search_filter, object_filter or '')
         display_attrs = self._config_get(object_type, 'display')
-        r = self._lom.get_multiple(base, search_filter, attrs=display_attrs)
+        return base, search_filter, self._scope(object_type), display_attrs
+
+    def _search_for_objects_of_type(self, object_type, search_filter):
+        base, search_filter, scope, display_attrs = \
+            self._objects_of_type_query(object_type, search_filter)
+        r = self._merge_results([self._lom.get_multiple(base, chunk,
+            scope=scope, attrs=display_attrs) \
+            for chunk in self._filter_chunks(search_filter)])
         for obj in r:
             self._add_missing_attributes(obj, object_type)
         return r
 
+    def _iter_objects_of_type(self, object_type, search_filter):
+        base, search_filter, scope, display_attrs = \
+            self._objects_of_type_query(object_type, search_filter)
+        chunks = self._filter_chunks(search_filter)
+        # entries matched by more than one chunk are only yielded once
+        seen = set() if len(chunks) > 1 else None
+        for chunk in chunks:
+            for obj in self._lom.iter_paged(base, chunk, scope=scope,
+                    attrs=display_attrs,
+                    page_size=self._config_get('page_size', default=500)):
+                if seen is not None:
+                    if obj[0].lower() in seen:
+                        continue
+                    seen.add(obj[0].lower())
+                self._add_missing_attributes(obj, object_type)
+                yield list(obj)
+
     def _get(self, search_term, item_type):
         obj = self._get_single(item_type, search_term,
             attrs=self._config_get(item_type, 'display'))
         self._add_missing_attributes(obj, item_type)
         return [list(obj)]
 
+    def _get_by_dn(self, dn, item_type):
+        obj = self._lom.get_single(dn, 'objectClass=*', scope=ldap.SCOPE_BASE,
+            attrs=self._config_get(item_type, 'display'))
+        self._add_missing_attributes(obj, item_type)
+        return [list(obj)]
+
+    def _search_filter(self, search_term, item_type):
+        fields = self._config_get(item_type, search)
+        if not fields:
+            # an empty OR would be dropped from the query, matching every
+            # object of the type
+            raise ValueError("No search attributes configured for type '%s'"
+                             % item_type)
+        return self._build_search_filter(fields, [search_term], suffix='*')
+
     def _search(self, search_term, item_type):
-        search_filter = self._build_search_filter(
-                                 self._config_get(item_type, search),
-                                 ['%s*' % search_term])
+        search_filter = self._search_filter(search_term, item_type)
         results = self._search_for_objects_of_type(item_type, search_filter)
         if not results:
             raise RuntimeError('No results for search query "%s"' %search_term)
         return [list(r) for r in results]
 
+    def _iter_search(self, search_term, item_type):
+        found = False
+        for obj in self._iter_objects_of_type(item_type,
+                self._search_filter(search_term, item_type)):
+            found = True
+            yield obj
+        if not found:
+            raise RuntimeError('No results for search query "%s"' %search_term)
+
     def _create(self, name, item_type):
         dn = self._generate_dn(item_type, name)
         attrs = self._config_get(item_type, 'schema')
         self._lom.create_object(dn, attrs)
-        return self._get(name, item_type)
+        return self._get_by_dn(dn, item_type)
 
-    def _delete(self, name, item_type):
+    def _delete(self, name, item_type, **kwargs):
         dn = self._get_dn(item_type, name)
-        self._lom.delete_object(dn)
+        if not kwargs.get('recursive'):
+            self._lom.delete_object(dn)
+            return
+        status = self._lom.delete_subtree(dn,
+            page_size=self._config_get('page_size', default=500),
+            max_in_flight=self._config_get('max_in_flight', default=16))
+        results = []
+        failures = 0
+        skipped = 0
+        for entry_dn, error in status:
+            if error is None:
+                results.append([entry_dn, {'status': ['deleted']}])
+            elif isinstance(error, SkippedError):
+                skipped += 1
+                results.append([entry_dn, {'status': ['skipped'],
+                                           'message': [error.__str__()]}])
+            else:
+                failures += 1
+                results.append([entry_dn, {'status': ['failed'],
+                                           'message': [error.__str__()]}])
+        if failures:
+            message = "Failed to delete %d of %d entries" \
+                      %(failures, len(status))
+            if skipped:
+                message += "; skipped %d entries above them" % skipped
+            raise PartialResultsError(message, results)
+        return results
 
     def _insert_or_remove(self, action, member_name, member_type,
-                          group_name, group_type):
-        group_dn = self._get_single(group_type, group_name)[0]
-        member_dn = self._get_single(member_type, member_name)[0]
+                          group_name, group_type, known_dns=None):
+        known_dns = known_dns or {}
+        group_dn = known_dns.get((group_type, group_name)) or \
+                   self._get_dn(group_type, group_name)
+        member_dn = known_dns.get((member_type, member_name)) or \
+                    self._get_dn(member_type, member_name)
         if action == insert:
             func = self._lom.add_attribute
         elif action == remove:
@@ -287,91 +1309,619 @@ class LDAPAdminTool():
     def _remove(self, *args, **kwargs):
         return self._insert_or_remove(remove, *args, **kwargs)
 
-    def _members(self, group_name, group_type, **kwargs):
+    def _members_filter(self, group_type, group_dn):
         # this isn't quite right...
         member_of_attr = self._config_get(group_type, 'memberOf',
                                           default='memberOf')
         use_oid = self._config_get(group_type, 'member_matching_rule_in_chain',
                                    default = False)
         oid = matching_rule_in_chain if use_oid else ''
-        group_dn = self._get_dn(group_type, group_name)
-        search_filter = "(%s%s=%s)" %(member_of_attr, oid, group_dn)
-        member_type =  kwargs.get('member_type')
-        return self._search_for_objects_of_type(member_type, search_filter)
+        return Term(member_of_attr, group_dn, rule=oid)
 
-    def _membership(self, member_name, member_type, **kwargs):
+    def _membership_filter(self, member_type, member_dn):
         member_attr = self._config_get(member_type, 'member',
                                           default='member')
         use_oid = self._config_get(member_type,
                                    'member_of_matching_rule_in_chain',
                                    default = False)
         oid = matching_rule_in_chain if use_oid else ''
+        return Term(member_attr, member_dn, rule=oid)
+
+    def _members(self, group_name, group_type, **kwargs):
+        group_dn = self._get_dn(group_type, group_name)
+        search_filter = self._members_filter(group_type, group_dn)
+        member_type =  kwargs.get('member_type')
+        return self._search_for_objects_of_type(member_type, search_filter)
+
+    def _membership(self, member_name, member_type, **kwargs):
         member_dn = self._get_dn(member_type, member_name)
-        search_filter = "(%s%s=%s)" %(member_attr, oid, member_dn)
+        search_filter = self._membership_filter(member_type, member_dn)
         group_type =  kwargs.get('member_type')
         return self._search_for_objects_of_type(group_type, search_filter)
 
+    def _iter_members(self, group_name, group_type, **kwargs):
+        group_dn = self._get_dn(group_type, group_name)
+        for obj in self._iter_objects_of_type(kwargs.get('member_type'),
+                self._members_filter(group_type, group_dn)):
+            yield obj
+
+    def _iter_membership(self, member_name, member_type, **kwargs):
+        member_dn = self._get_dn(member_type, member_name)
+        for obj in self._iter_objects_of_type(kwargs.get('member_type'),
+                self._membership_filter(member_type, member_dn)):
+            yield obj
+
+    def _attribute_values(self, attrs, name):
+        for key, values in attrs.items():
+            if key.lower() == name.lower():
+                return values
+        return []
+
+    def _ranged_values(self, dn, attrs, name):
+        """
+        Return every value of the attribute name of the entry dn, whose
+        attributes as returned by a search are attrs.  Active Directory
+        returns large attributes a range at a time, for instance as
+        'member;range=0-1499'; the remaining ranges are read one by one.
+        """
+        prefix = name.lower() + ';range='
+        ranged = [k for k in attrs if k.lower().startswith(prefix)]
+        if not ranged:
+            return self._attribute_values(attrs, name)
+        values = []
+        while True:
+            values.extend(attrs[ranged[0]])
+            high = ranged[0][len(prefix):].split('-', 1)[-1]
+            if high == '*':
+                return values
+            attrs = self._lom.get_single(dn, 'objectClass=*',
+                scope=ldap.SCOPE_BASE,
+                attrs=['%s;range=%d-*' %(name, int(high) + 1)])[1]
+            ranged = [k for k in attrs if k.lower().startswith(prefix)]
+            if not ranged:
+                raise RuntimeError("No further values of '%s' returned for "
+                                   "'%s' after range ending at %s" \
+                                   %(name, dn, high))
+
+    def _load_membership_matrix(self, group_type, member_type=None):
+        page_size = self._config_get('page_size', default=500)
+        matrix = MembershipMatrix()
+        identifier = self._config_get(group_type, 'identifier', default='cn')
+        member_attr = self._config_get(group_type, 'member', default='member')
+        base, search_filter, scope, display_attrs = \
+            self._objects_of_type_query(group_type, '(objectClass=*)')
+        for dn, attrs in self._lom.iter_paged(base, str(search_filter),
+                scope=scope, attrs=[identifier, member_attr],
+                page_size=page_size):
+            name = (self._attribute_values(attrs, identifier) or \
+                    ldap.dn.explode_dn(dn, notypes=1)[:1] or [dn])[0]
+            matrix.add_group(dn, name,
+                             self._ranged_values(dn, attrs, member_attr))
+        if member_type:
+            base, search_filter, scope, display_attrs = \
+                self._objects_of_type_query(member_type, '(objectClass=*)')
+            matrix.set_users(dn for dn, attrs in self._lom.iter_paged(base,
+                str(search_filter), scope=scope, attrs=['1.1'],
+                page_size=page_size))
+        return matrix
+
+    def _analyze_set(self, operation, group_names, matrix):
+        rows = [matrix.row(n) for n in group_names]
+        return [[matrix.dns[i], {}] for i in operation(matrix, rows)]
+
+    def _analyze_orphans(self, matrix):
+        return [[matrix.dns[i], {}] for i in matrix.orphans()]
+
+    def _distribution(self, label, values):
+        counts = collections.Counter(values)
+        return [[label, dict((str(k), [str(v)]) for k, v in counts.items())]]
+
+    def _analyze_sizes(self, matrix):
+        return self._distribution('groups per size', matrix.sizes())
+
+    def _analyze_depth(self, matrix):
+        return self._distribution('groups per nesting depth',
+                                  matrix.depths())
+
+    def _analyze_counts(self, matrix):
+        return [[matrix.dns[u], {'groups': [str(n)]}] \
+                for u, n in sorted(matrix.effective_counts().items())]
+
+    def _output_entry(self, results=None, error=None):
+        if error is not None:
+            return {'success': False,
+                    'message': error.__str__(),
+                    'results': getattr(error, 'results', [])}
+        return {'success': True,
+                'message': None,
+                'results': results or []}
+
     def _generate_output(self, function, args_list, iterable, **kwargs):
         output = {}
         for i in iterable:
-            success = True
-            message = None
-            results = []
             try:
-                results = function(i, *args_list, **kwargs) or results
+                output[i] = self._output_entry(
+                    results=function(i, *args_list, **kwargs))
             except Exception as e:
-                success = False
-                message = e.__str__()
-            output[i] = {'success': success,
-                         'message': message,
-                         'results': results}
+                output[i] = self._output_entry(error=e)
         return output
 
+    def _stream_output(self, function, args_list, iterable, **kwargs):
+        """
+        Like _generate_output, but yield (name, output entry) pairs.  The
+        results of each entry are an iterator that fetches objects a page
+        at a time as it is consumed, and raises if the query fails, so an
+        entry is only known to be successful once it has been consumed.
+        """
+        for i in iterable:
+            yield i, self._output_entry(results=function(i, *args_list,
+                                                         **kwargs))
+
     def get(self, object_type, *object_names):
-        return self._generate_output(self._get, [object_type], object_names)
+        return self._generate_output(self._cached(get, self._get),
+                                     [object_type], object_names)
 
-    def search(self, object_type, *object_names):
-        return self._generate_output(self._search, [object_type], object_names)
+    def search(self, object_type, *object_names, **kwargs):
+        if kwargs.get('stream') and not self._caching():
+            return self._stream_output(self._iter_search, [object_type],
+                                       object_names)
+        return self._generate_output(self._cached(search, self._search),
+                                     [object_type], object_names)
 
     def create(self, object_type, *object_names):
-        return self._generate_output(self._create, [object_type], object_names)
-
-    def delete(self, object_type, *object_names):
-        return self._generate_output(self._delete, [object_type], object_names)
+        output = self._generate_output(self._create, [object_type],
+                                       object_names)
+        return self._written(output,
+                             functools.partial(self._evict, object_type))
+
+    def delete(self, object_type, *object_names, **kwargs):
+        if kwargs.get('recursive'):
+            # a subtree may hold objects of any type
+            evict = self._clear_cache
+        else:
+            evict = functools.partial(self._evict, object_type)
+        output = self._generate_output(self._delete, [object_type],
+                                       object_names, **kwargs)
+        return self._written(output, evict)
 
     def insert(self, group_object_type, group_object_name,
                member_object_type, *member_object_names):
-        return self._generate_output(self._insert, [member_object_type,
-                                                    group_object_name,
-                                                    group_object_type],
-                                     member_object_names)
+        known_dns = self._prefetch_dns(
+            (group_object_type, [group_object_name]),
+            (member_object_type, member_object_names))
+        output = self._generate_output(self._insert, [member_object_type,
+                                                  group_object_name,
+                                                  group_object_type],
+                                       member_object_names,
+                                       known_dns=known_dns)
+        return self._written(output, functools.partial(self._evict,
+            group_object_type, member_object_type))
 
     def remove(self, group_object_type, group_object_name,
                member_object_type, *member_object_names):
-        return self._generate_output(self._remove, [member_object_type,
-                                                    group_object_name,
-                                                    group_object_type],
-                                     member_object_names)
+        known_dns = self._prefetch_dns(
+            (group_object_type, [group_object_name]),
+            (member_object_type, member_object_names))
+        output = self._generate_output(self._remove, [member_object_type,
+                                                  group_object_name,
+                                                  group_object_type],
+                                       member_object_names,
+                                       known_dns=known_dns)
+        return self._written(output, functools.partial(self._evict,
+            group_object_type, member_object_type))
 
     def members(self, object_type, *object_names, **kwargs):
-        return self._generate_output(self._members, [object_type],
-                                     object_names, **kwargs)
+        if kwargs.pop('stream', False) and not self._caching():
+            return self._stream_output(self._iter_members, [object_type],
+                                       object_names, **kwargs)
+        return self._generate_output(self._cached(members, self._members),
+                                     [object_type], object_names, **kwargs)
 
     def membership(self, object_type, *object_names, **kwargs):
-        return self._generate_output(self._membership, [object_type],
-                                     object_names, **kwargs)
+        if kwargs.pop('stream', False) and not self._caching():
+            return self._stream_output(self._iter_membership, [object_type],
+                                       object_names, **kwargs)
+        return self._generate_output(self._cached(membership,
+                                                  self._membership),
+                                     [object_type], object_names, **kwargs)
+
+    def analyze(self, group_type, member_type=None, intersections=(),
+                unions=(), orphans=False, sizes=False, counts=False,
+                depth=False):
+        """
+        Load the membership of every group of group_type (and the DNs of
+        every object of member_type, if given) once, then answer each
+        requested question from memory.  Each question is a key of the
+        output.  Without any question, orphans, sizes and depth are
+        reported.
+        """
+        queries = []
+        for names in intersections:
+            queries.append(('intersection of %s' % ', '.join(names),
+                functools.partial(self._analyze_set,
+                                  MembershipMatrix.intersection, names)))
+        for names in unions:
+            queries.append(('union of %s' % ', '.join(names),
+                functools.partial(self._analyze_set,
+                                  MembershipMatrix.union, names)))
+        if not (queries or orphans or sizes or counts or depth):
+            orphans = sizes = depth = True
+        if orphans:
+            queries.append(('orphans', self._analyze_orphans))
+        if sizes:
+            queries.append(('sizes', self._analyze_sizes))
+        if counts:
+            queries.append(('counts', self._analyze_counts))
+        if depth:
+            queries.append(('depth', self._analyze_depth))
+        try:
+            matrix = self._load_membership_matrix(group_type, member_type)
+        except Exception as e:
+            return dict((label, self._output_entry(error=e)) \
+                        for label, function in queries)
+        output = {}
+        for label, function in queries:
+            try:
+                output[label] = self._output_entry(results=function(matrix))
+            except Exception as e:
+                output[label] = self._output_entry(error=e)
+        return output
 
-if __name__ == '__main__':
+class AsyncReturn(Exception):
+
+    """
+    Raised by an AsyncLDAPAdminTool coroutine to return a value to the
+    coroutine that is waiting on it.
+    """
+
+    def __init__(self, value=None):
+        Exception.__init__(self)
+        self.value = value
+
+class LDAPFuture():
+
+    """
+    The eventual output of an operation started by AsyncLDAPAdminTool.
+    """
+
+    def __init__(self):
+        self._done = False
+        self._value = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            raise RuntimeError("The operation has not completed yet")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def exception(self):
+        return self._error
+
+    def add_done_callback(self, callback):
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _finish(self, value, error):
+        self._done = True
+        self._value = value
+        self._error = error
+        for callback in self._callbacks:
+            callback(self)
+        self._callbacks = []
 
-    # command literals
-    get    = 'get'
-    search = 'search'
-    create = 'create'
-    delete = 'delete'
-    insert = 'insert'
-    remove = 'remove'
-    members = 'members'
-    membership = 'membership'
+    def set_result(self, value):
+        self._finish(value, None)
+
+    def set_exception(self, error):
+        self._finish(None, error)
+
+class AsyncLDAPAdminTool(LDAPAdminTool):
+
+    """
+    The AsyncLDAPAdminTool class exposes the same commands as
+    LDAPAdminTool, but no command blocks the calling thread.  Each command
+    starts its LDAP operations without waiting for them and immediately
+    returns an LDAPFuture for its output, so that any number of commands
+    can be in flight over the single connection at once.
+
+    Operations progress whenever poll() is called.  Services with their
+    own event loop should call poll() when the descriptor returned by
+    fileno() becomes readable; others can call run_until_complete().
+
+    Internally each command is a generator-based coroutine.  A coroutine
+    yields the message id of an LDAP operation to wait for its result
+    data, or yields another coroutine to wait for its return value, and
+    returns a value by raising AsyncReturn.  Results are never read from
+    the result cache, but writes evict cached results as they do in
+    LDAPAdminTool, so that other ldapadm processes sharing the cache do
+    not serve stale results.
+    """
+
+    def __init__(self, config):
+        LDAPAdminTool.__init__(self, config)
+        self._waiting = {}
+        self._generation = self._lom.generation
+
+    def _spawn(self, coroutine):
+        future = LDAPFuture()
+        self._step([coroutine], future)
+        return future
+
+    def _step(self, stack, future, value=None, error=None):
+        while stack:
+            try:
+                if error is not None:
+                    request = stack[-1].throw(error)
+                else:
+                    request = stack[-1].send(value)
+            except AsyncReturn as r:
+                stack.pop()
+                value, error = r.value, None
+                continue
+            except StopIteration:
+                stack.pop()
+                value, error = None, None
+                continue
+            except Exception as e:
+                stack.pop()
+                value, error = None, e
+                continue
+            if isinstance(request, types.GeneratorType):
+                stack.append(request)
+                value, error = None, None
+            else:
+                self._fail_stale()
+                self._waiting[request] = (stack, future)
+                return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+    def _fail_stale(self, error=None):
+        """
+        If the connection has been dropped since the waiting operations
+        were started, they will never complete: fail all of them.  Returns
+        the number of coroutines resumed.
+        """
+        if self._lom.generation == self._generation:
+            return 0
+        self._generation = self._lom.generation
+        # take every stale operation out first, since the coroutines may
+        # start new operations that reuse their message ids
+        stale = self._waiting.values()
+        self._waiting = {}
+        error = error or ldap.SERVER_DOWN(
+            {'desc': "Connection to the LDAP server was lost"})
+        for stack, future in stale:
+            self._step(stack, future, error=error)
+        return len(stale)
+
+    def _resume(self, msgid, value=None, error=None):
+        if msgid not in self._waiting:
+            # for instance an operation that has been abandoned
+            return 0
+        stack, future = self._waiting.pop(msgid)
+        self._step(stack, future, value=value, error=error)
+        return 1
+
+    def _resume_completed(self):
+        """
+        Resume the coroutines of every completed operation, draining the
+        results that are ready instead of polling each waiting operation.
+        """
+        if not self._lom.reports_msgid:
+            return self._resume_each()
+        resumed = self._fail_stale()
+        while self._waiting:
+            try:
+                completed = self._lom.poll_any()
+            except ldap.LDAPError as e:
+                if isinstance(e, self._lom.connection_errors):
+                    failed = self._fail_stale(e)
+                    if not failed:
+                        break
+                    resumed += failed
+                    continue
+                info = e.args[0] if e.args else None
+                if isinstance(info, dict):
+                    resumed += self._resume(info.get('msgid'), error=e)
+                continue
+            if completed is None:
+                break
+            resumed += self._resume(completed[0], value=completed[1])
+        return resumed
+
+    def _resume_each(self):
+        # python-ldap 2 cannot tell which operation an error belongs to
+        resumed = self._fail_stale()
+        for msgid in list(self._waiting):
+            if msgid not in self._waiting:
+                continue
+            try:
+                rdata = self._lom.poll_result(msgid)
+            except ldap.LDAPError as e:
+                if isinstance(e, self._lom.connection_errors):
+                    resumed += self._fail_stale(e)
+                else:
+                    resumed += self._resume(msgid, error=e)
+                continue
+            if rdata is not None:
+                resumed += self._resume(msgid, value=rdata)
+        return resumed
+
+    def fileno(self):
+        return self._lom.fileno()
+
+    def pending(self):
+        return len(self._waiting)
+
+    def poll(self, timeout=0):
+        """
+        Resume every coroutine whose LDAP operation has completed.  If
+        none has, wait up to timeout seconds (forever if timeout is None)
+        for the connection to become readable and check again.  Returns
+        the number of coroutines resumed.
+        """
+        resumed = self._resume_completed()
+        if resumed or not self._waiting or timeout == 0:
+            return resumed
+        select.select([self.fileno()], [], [], timeout)
+        return self._resume_completed()
+
+    def run_until_complete(self, future):
+        while not future.done():
+            if not self._waiting:
+                raise RuntimeError("The operation is not waiting on LDAP")
+            self.poll(timeout=None)
+        return future.result()
+
+    def _search_multiple(self, sbase, sfilter, scope=SCOPE, attrs=None):
+        ldif = yield self._lom.search_async(sbase, sfilter, scope=scope,
+                                            attrs=attrs)
+        raise AsyncReturn(self._lom.multiple_result(ldif))
+
+    def _search_single(self, sbase, sfilter, scope=SCOPE, attrs=None):
+        ldif = yield self._lom.search_async(sbase, sfilter, scope=scope,
+                                            attrs=attrs)
+        raise AsyncReturn(self._lom.single_result(ldif, sbase, sfilter))
+
+    def _get_single(self, item_type, search_term, attrs=None):
+        sbase, sfilter, scope = self._single_query(item_type, search_term)
+        obj = yield self._search_single(sbase, sfilter, scope=scope,
+                                        attrs=attrs)
+        raise AsyncReturn(obj)
+
+    def _get_dn(self, item_type, name):
+        obj = yield self._get_single(item_type, name, attrs=['1.1'])
+        raise AsyncReturn(obj[0])
+
+    def _search_for_objects_of_type(self, object_type, search_filter):
+        base, search_filter, scope, display_attrs = \
+            self._objects_of_type_query(object_type, search_filter)
+        result_lists = []
+        for chunk in self._filter_chunks(search_filter):
+            result_lists.append((yield self._search_multiple(base, chunk,
+                scope=scope, attrs=display_attrs)))
+        r = self._merge_results(result_lists)
+        for obj in r:
+            self._add_missing_attributes(obj, object_type)
+        raise AsyncReturn(r)
+
+    def _get(self, search_term, item_type):
+        obj = yield self._get_single(item_type, search_term,
+            attrs=self._config_get(item_type, 'display'))
+        self._add_missing_attributes(obj, item_type)
+        raise AsyncReturn([list(obj)])
+
+    def _get_by_dn(self, dn, item_type):
+        obj = yield self._search_single(dn, 'objectClass=*',
+            scope=ldap.SCOPE_BASE,
+            attrs=self._config_get(item_type, 'display'))
+        self._add_missing_attributes(obj, item_type)
+        raise AsyncReturn([list(obj)])
+
+    def _search(self, search_term, item_type):
+        search_filter = self._search_filter(search_term, item_type)
+        results = yield self._search_for_objects_of_type(item_type,
+                                                         search_filter)
+        if not results:
+            raise RuntimeError('No results for search query "%s"' %search_term)
+        raise AsyncReturn([list(r) for r in results])
+
+    def _create(self, name, item_type):
+        dn = self._generate_dn(item_type, name)
+        attrs = self._config_get(item_type, 'schema')
+        yield self._lom.create_object_async(dn, attrs)
+        results = yield self._get_by_dn(dn, item_type)
+        raise AsyncReturn(results)
+
+    def _delete(self, name, item_type, **kwargs):
+        if kwargs.get('recursive'):
+            raise ValueError("Recursive delete is not supported by "
+                             "AsyncLDAPAdminTool")
+        dn = yield self._get_dn(item_type, name)
+        yield self._lom.delete_object_async(dn)
+
+    def _prefetch_dns(self, *lookups):
+        # names are looked up concurrently instead
+        return {}
+
+    def _caching(self):
+        return False
+
+    def _written(self, output, evict):
+        # the writes have only started when the output future is returned
+        output.add_done_callback(lambda future: evict())
+        return output
+
+    def analyze(self, *args, **kwargs):
+        raise ValueError("analyze is not supported by AsyncLDAPAdminTool")
+
+    def _stream_output(self, *args, **kwargs):
+        raise ValueError("Streamed output is not supported by "
+                         "AsyncLDAPAdminTool")
+
+    def _insert_or_remove(self, action, member_name, member_type,
+                          group_name, group_type, known_dns=None):
+        group_dn = yield self._get_dn(group_type, group_name)
+        member_dn = yield self._get_dn(member_type, member_name)
+        attr = self._config_get(group_type, 'member', default='member')
+        oldobj = (yield self._search_single(group_dn, 'objectClass=*',
+            scope=ldap.SCOPE_BASE, attrs=[attr]))[1]
+        if action == insert:
+            ml = self._lom.add_values_modlist(oldobj, attr, member_dn)
+        elif action == remove:
+            ml = self._lom.remove_values_modlist(oldobj, attr, member_dn)
+        yield self._lom.modify_async(group_dn, ml)
+
+    def _members(self, group_name, group_type, **kwargs):
+        group_dn = yield self._get_dn(group_type, group_name)
+        search_filter = self._members_filter(group_type, group_dn)
+        member_type =  kwargs.get('member_type')
+        results = yield self._search_for_objects_of_type(member_type,
+                                                         search_filter)
+        raise AsyncReturn(results)
+
+    def _membership(self, member_name, member_type, **kwargs):
+        member_dn = yield self._get_dn(member_type, member_name)
+        search_filter = self._membership_filter(member_type, member_dn)
+        group_type =  kwargs.get('member_type')
+        results = yield self._search_for_objects_of_type(group_type,
+                                                         search_filter)
+        raise AsyncReturn(results)
+
+    def _generate_output(self, function, args_list, iterable, **kwargs):
+        output_future = LDAPFuture()
+        output = {}
+        names = list(iterable)
+        remaining = [len(names)]
+
+        def record(name, future):
+            if future.exception() is not None:
+                output[name] = self._output_entry(error=future.exception())
+            else:
+                output[name] = self._output_entry(results=future.result())
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                output_future.set_result(output)
+
+        if not names:
+            output_future.set_result(output)
+        for i in names:
+            self._spawn(function(i, *args_list, **kwargs)).add_done_callback(
+                functools.partial(record, i))
+        return output_future
+
+if __name__ == '__main__':
 
     def get_new_parser():
         return argparse.ArgumentParser(add_help=False)
@@ -428,7 +1978,18 @@ if __name__ == '__main__':
     parser.add_argument('-r', '--pretty',
         action='store_true',
         help="""Print pretty, colorful, easy-to-read output instead of
-                YAML-formatted output.""")
+                YAML-formatted output.  Colors are used only when printing
+                to a terminal.""")
+
+    parser.add_argument('--pager',
+        action='store_true',
+        help="""Show pretty output through $PAGER when printing to a
+                terminal.""")
+
+    parser.add_argument('--no-cache',
+        action='store_true',
+        help="""Do not read results from or store results in the result
+                cache, even if one is configured.""")
 
     auth_group = parser.add_mutually_exclusive_group()
 
@@ -471,6 +2032,36 @@ if __name__ == '__main__':
         parents=[single_type_parser],
         description="""Find all groups that an object is a member of.""")
 
+    parser_analyze = subparser.add_parser(analyze,
+        description="""Load the membership of every group of a type at once
+                       and analyze it.  Without any analysis options,
+                       --orphans, --sizes and --depth are reported.""")
+    parser_analyze.add_argument('group_object_type', help="""
+        Type, as specified in configuration, of the groups to analyze.""")
+    parser_analyze.add_argument('-t', '--member-type', metavar='MEMBER_TYPE',
+        help="""Type, as specified in configuration, of the members.  Used
+                to include objects that are not in any group in --counts.""")
+    parser_analyze.add_argument('--intersection', nargs='+', action='append',
+        default=[], metavar='GROUP',
+        help="""List the direct members common to all of the named
+                groups.  May be given more than once.""")
+    parser_analyze.add_argument('--union', nargs='+', action='append',
+        default=[], metavar='GROUP',
+        help="""List the direct members of any of the named groups.  May
+                be given more than once.""")
+    parser_analyze.add_argument('--orphans', action='store_true',
+        help='List groups without members.')
+    parser_analyze.add_argument('--sizes', action='store_true',
+        help='Report the number of groups of each size.')
+    parser_analyze.add_argument('--counts', action='store_true',
+        help="""Report the number of groups each member belongs to,
+                including nested group membership.""")
+    parser_analyze.add_argument('--depth', action='store_true',
+        help='Report the number of groups at each nesting depth.')
+
+    parser_delete.add_argument('-R', '--recursive', action='store_true',
+        help="""Delete the object and every object beneath it in the
+                directory tree.""")
     parser_members.add_argument('-t', '--member-type', metavar='MEMBER_TYPE')
     parser_membership.add_argument('-t', '--group-type', metavar='GROUP_TYPE')
 
@@ -491,18 +2082,26 @@ if __name__ == '__main__':
     elif args.no_auth:
         config['auth_type'] = 'noauth'
 
+    if args.no_cache and isinstance(config.get('cache'), dict):
+        # writes still evict cached results for other processes
+        config['cache']['bypass'] = True
+
     lat = LDAPAdminTool(config)
 
     out = None
 
+    # pretty output is rendered while results are still being fetched
+    stream = args.pretty
+
     if args.command == get:
         out = lat.get(args.object_type, *args.object_name)
     elif args.command == search:
-        out = lat.search(args.object_type, *args.object_name)
+        out = lat.search(args.object_type, *args.object_name, stream=stream)
     elif args.command == create:
         out = lat.create(args.object_type, *args.object_name)
     elif args.command == delete:
-        out = lat.delete(args.object_type, *args.object_name)
+        out = lat.delete(args.object_type, *args.object_name,
+                         recursive=args.recursive)
     elif args.command == insert:
         out = lat.insert(args.group_object_type, args.group_object_name,
                    args.member_object_type, *args.member_object_name)
@@ -511,19 +2110,29 @@ if __name__ == '__main__':
                    args.member_object_type, *args.member_object_name)
     elif args.command == members:
         out = lat.members(args.object_type, *args.object_name,
-                          member_type=args.member_type)
+                          member_type=args.member_type, stream=stream)
     elif args.command == membership:
         out = lat.membership(args.object_type, *args.object_name,
-                          group_type=args.group_type)
+                          group_type=args.group_type, stream=stream)
+    elif args.command == analyze:
+        out = lat.analyze(args.group_object_type,
+                          member_type=args.member_type,
+                          intersections=args.intersection,
+                          unions=args.union,
+                          orphans=args.orphans,
+                          sizes=args.sizes,
+                          counts=args.counts,
+                          depth=args.depth)
     else:
         pass
 
     if args.pretty:
-        render_pretty_output(out)
+        success = render_pretty_output(out, page=args.pager)
     else:
         render_yaml_output(out)
+        success = all([v['success'] for k, v in out.items()])
 
-    if not all([v['success'] for k, v in out.items()]):
+    if not success:
         exit(1)
     else:
         exit(0)
@@ -6,9 +6,13 @@ import ldap, ldap.modlist
 import ldap_test
 import random
 import copy
+import shutil
+from src.ldapadm import LDAPAdminTool, AsyncLDAPAdminTool, LDAPObjectManager, \
+                        SkippedError, auth
 
 proj_root_dir = os.path.split(os.path.dirname(os.path.realpath(__file__)))[0]
 conf_path = os.path.join(proj_root_dir, 'tmp/ldapadm-test.conf.yaml')
+cache_path = os.path.join(proj_root_dir, 'tmp/ldapadm-test-cache')
 
 def setUpModule():
     global server, config, ldapobject
@@ -229,6 +233,28 @@ class LdapadmGetTests(LdapadmTest):
         self.verifyOutputContains(output, 'group', group1)
         self.verifyOutputDoesNotContain(output, 'group', group2)
 
+    def testGetWithTimeoutsAndHedgedReads(self):
+        user = random.choice(self.user_list)
+        options = yaml.dump({'timeout': 10, 'network_timeout': 5,
+                             'retries': 1, 'hedge_uri': config['uri'],
+                             'hedge_delay': 0})
+        output = LdapadmOutput('-o', options, 'get', 'user', user)
+        self.verifyOutputContains(output, 'user', user)
+
+    def testGetNameWithFilterSpecialCharacters(self):
+        name = 'dave (ops)*'
+        self.createObject('user', name)
+        output = self.ldapadmGet('user', name)
+        self.assertTrue(output.success)
+        self.verifyOutputContains(output, 'user', name)
+
+    def testPrettyGetWithoutTerminalHasNoColors(self):
+        user = random.choice(self.user_list)
+        output = LdapadmOutput('-r', 'get', 'user', user)
+        self.assertEqual(output.code, 0)
+        self.assertIn(self.getDN('user', user), output.stdout)
+        self.assertNotIn('\x1b[', output.stdout)
+
 class LdapadmSearchTests(LdapadmTest):
 
     def testSearchUser(self):
@@ -237,6 +263,26 @@ class LdapadmSearchTests(LdapadmTest):
         for user in self.user_list:
             self.verifyOutputContains(output, 'user', user)
 
+    def testOneLevelScopeSkipsNestedObjects(self):
+        parent = random.choice(self.user_list)
+        nested_dn = 'cn=nested,%s' % self.getDN('user', parent)
+        ldapobject.add_ext_s(nested_dn, self.getNewTestObjectModlist('user'))
+        try:
+            options = yaml.dump({'user': {'scope': 'one_level'}})
+            output = LdapadmOutput('-o', options, 'search', 'user', 'nested')
+            self.assertFalse(output.success)
+            output = LdapadmOutput('search', 'user', 'nested')
+            self.assertTrue(output.success)
+        finally:
+            self.deleteObjectByDN(nested_dn)
+
+    def testSearchWithoutSearchAttributesFails(self):
+        options = yaml.dump({'user': {'search': []}})
+        user = random.choice(self.user_list)
+        output = LdapadmOutput('-o', options, 'search', 'user', user)
+        self.assertFalse(output.success)
+        self.assertFalse(output.output_object[user]['results'])
+
 class LdapadmCreateTests(LdapadmTest):
 
     def testCreateUser(self):
@@ -256,6 +302,19 @@ class LdapadmDeleteTests(LdapadmTest):
         self.ldapadmDeleteObject(object_type, user)
         self.verifyObjectDoesNotExistByName(object_type, user)
 
+    def testRecursiveDeleteRemovesSubtree(self):
+        object_type = 'user'
+        user = random.choice(self.user_list)
+        child_dn = 'cn=child,%s' % self.getDN(object_type, user)
+        grandchild_dn = 'cn=grandchild,%s' % child_dn
+        for dn in (child_dn, grandchild_dn):
+            ldapobject.add_ext_s(dn, self.getNewTestObjectModlist(object_type))
+        output = LdapadmOutput('delete', '-R', object_type, user)
+        self.assertTrue(output.success)
+        self.verifyObjectDoesNotExistByName(object_type, user)
+        self.verifyDoesNotExistByDN(child_dn)
+        self.verifyDoesNotExistByDN(grandchild_dn)
+
 class LdapadmInsertTests(LdapadmTest):
 
     def testInsertWithBadArgumentsReturnsError(self):
@@ -270,6 +329,15 @@ class LdapadmInsertTests(LdapadmTest):
         self.ldapadmInsert(group, user)
         self.verifyGroupContainsUser(group, user)
 
+    def testInsertManyUsersIntoGroupWithSmallFilterLimit(self):
+        group = random.choice(self.group_list)
+        options = yaml.dump({'max_filter_terms': 2})
+        output = LdapadmOutput('-o', options, 'insert', 'group', group,
+                               'user', *self.user_list)
+        self.assertTrue(output.success)
+        for user in self.user_list:
+            self.verifyGroupContainsUser(group, user)
+
 class LdapadmRemoveTests(LdapadmTest):
 
     def setUp(self):
@@ -307,3 +375,168 @@ class LdapadmMembershipTests(LdapadmTest):
         output = self.ldapadmMembership(user)
         self.verifyOutputContains(output, 'group', group)
         self.verifyOutputDoesNotContain(output, 'group', non_group)
+
+class LdapadmCacheTests(LdapadmTest):
+
+    def setUp(self):
+        super(LdapadmCacheTests, self).setUp()
+        self.cache_options = yaml.dump({'cache': {'backend': 'disk',
+                                                  'path': cache_path}})
+
+    def tearDown(self):
+        super(LdapadmCacheTests, self).tearDown()
+        if os.path.exists(cache_path):
+            shutil.rmtree(cache_path)
+
+    def testGetIsAnsweredFromCacheUnlessBypassed(self):
+        user = random.choice(self.user_list)
+        self.assertTrue(LdapadmOutput('-o', self.cache_options,
+                                      'get', 'user', user).success)
+        self.deleteObjectByDN(self.getDN('user', user))
+        self.assertTrue(LdapadmOutput('-o', self.cache_options,
+                                      'get', 'user', user).success)
+        self.assertFalse(LdapadmOutput('-o', self.cache_options, '--no-cache',
+                                       'get', 'user', user).success)
+
+    def testCachedResultsAreNotSharedAcrossBases(self):
+        user = random.choice(self.user_list)
+        self.assertTrue(LdapadmOutput('-o', self.cache_options,
+                                      'get', 'user', user).success)
+        other_base = yaml.dump({'user': {'base': config['group']['base']}})
+        self.assertFalse(LdapadmOutput('-o', self.cache_options,
+                                       '-o', other_base,
+                                       'get', 'user', user).success)
+
+    def testDeleteEvictsCachedResults(self):
+        user = random.choice(self.user_list)
+        self.assertTrue(LdapadmOutput('-o', self.cache_options,
+                                      'get', 'user', user).success)
+        self.assertTrue(LdapadmOutput('-o', self.cache_options,
+                                      'delete', 'user', user).success)
+        self.assertFalse(LdapadmOutput('-o', self.cache_options,
+                                       'get', 'user', user).success)
+
+    def testCacheDirectoryWritableByOthersIsRefused(self):
+        os.makedirs(cache_path)
+        os.chmod(cache_path, 0o777)
+        user = random.choice(self.user_list)
+        self.assertFalse(LdapadmOutput('-o', self.cache_options,
+                                       'get', 'user', user).success)
+
+    def testRecursiveDeleteEvictsEveryType(self):
+        user = random.choice(self.user_list)
+        group = random.choice(self.group_list)
+        self.assertTrue(LdapadmOutput('-o', self.cache_options,
+                                      'get', 'group', group).success)
+        self.assertTrue(LdapadmOutput('-o', self.cache_options,
+                                      'delete', '-R', 'user', user).success)
+        self.assertEqual([f for d, s, files in os.walk(cache_path) \
+                          for f in files], [])
+
+class LdapadmAsyncTests(LdapadmTest):
+
+    def testAsyncGetRunsQueriesConcurrently(self):
+        tool = AsyncLDAPAdminTool(copy.deepcopy(config))
+        future = tool.get('user', *self.user_list)
+        self.assertFalse(future.done())
+        output = tool.run_until_complete(future)
+        for user in self.user_list:
+            self.assertTrue(output[user]['success'])
+            self.assertEqual(output[user]['results'][0][0],
+                             self.getDN('user', user))
+
+    def testAsyncInsertUserIntoGroup(self):
+        group = random.choice(self.group_list)
+        user = random.choice(self.user_list)
+        tool = AsyncLDAPAdminTool(copy.deepcopy(config))
+        self.verifyGroupDoesNotContainUser(group, user)
+        output = tool.run_until_complete(tool.insert('group', group,
+                                                     'user', user))
+        self.assertTrue(output[user]['success'])
+        self.verifyGroupContainsUser(group, user)
+
+    def testAsyncDeleteEvictsSharedCache(self):
+        user = random.choice(self.user_list)
+        cache_config = {'backend': 'disk', 'path': cache_path}
+        cache_options = yaml.dump({'cache': cache_config})
+        try:
+            self.assertTrue(LdapadmOutput('-o', cache_options,
+                                          'get', 'user', user).success)
+            tool_config = copy.deepcopy(config)
+            tool_config['cache'] = cache_config
+            tool = AsyncLDAPAdminTool(tool_config)
+            output = tool.run_until_complete(tool.delete('user', user))
+            self.assertTrue(output[user]['success'])
+            self.assertFalse(LdapadmOutput('-o', cache_options,
+                                           'get', 'user', user).success)
+        finally:
+            if os.path.exists(cache_path):
+                shutil.rmtree(cache_path)
+
+class LdapadmSubtreeDeleteTests(unittest.TestCase):
+
+    def testAncestorsOfFailedDeleteAreSkipped(self):
+        lom = LDAPObjectManager(config['uri'], auth.noauth)
+        entries = ['ou=top,o=test', 'ou=mid,ou=top,o=test',
+                   'cn=bad,ou=mid,ou=top,o=test',
+                   'cn=good,ou=top,o=test']
+        lom.supports_control = lambda oid: False
+        lom.iter_paged = lambda *args, **kwargs: [(dn, {}) for dn in entries]
+        error = ldap.INSUFFICIENT_ACCESS({'desc': 'Insufficient access'})
+        lom._delete_concurrently = lambda dns, max_in_flight: \
+            [(dn, error if dn.startswith('cn=bad') else None) for dn in dns]
+        status = dict(lom.delete_subtree('ou=top,o=test'))
+        self.assertIs(status['cn=bad,ou=mid,ou=top,o=test'], error)
+        self.assertIsNone(status['cn=good,ou=top,o=test'])
+        for dn in ('ou=mid,ou=top,o=test', 'ou=top,o=test'):
+            self.assertIsInstance(status[dn], SkippedError)
+
+class LdapadmReconnectTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lom = LDAPObjectManager(config['uri'], auth.noauth, retries=1,
+                                     retry_delay=0)
+        self.connections = []
+
+    def failOnce(self, ldo):
+        self.connections.append(ldo)
+        if len(self.connections) == 1:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        return 'result'
+
+    def testReadIsRetriedOnNewConnection(self):
+        self.assertEqual(self.lom._call(True, self.failOnce), 'result')
+        self.assertEqual(len(self.connections), 2)
+        self.assertIsNot(self.connections[0], self.connections[1])
+
+    def testWriteIsNotReplayed(self):
+        self.assertRaises(ldap.SERVER_DOWN, self.lom._call, False,
+                          self.failOnce)
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.lom._call(False, self.failOnce), 'result')
+        self.assertIsNot(self.connections[0], self.connections[1])
+
+class LdapadmAnalyzeTests(LdapadmTest):
+
+    def testIntersectionAndOrphans(self):
+        common, other = random.sample(self.user_list, 2)
+        for group in self.group_list:
+            self.insertUserIntoGroup(group, common)
+        self.insertUserIntoGroup(self.group_list[0], other)
+        output = LdapadmOutput('analyze', 'group', '--orphans',
+                               '--intersection', *self.group_list)
+        self.assertTrue(output.success)
+        self.verifyOutputContains(output, 'user', common)
+        self.verifyOutputDoesNotContain(output, 'user', other)
+        for group in self.group_list:
+            self.verifyOutputDoesNotContain(output, 'group', group)
+
+    def testRangedMemberValuesAreFollowed(self):
+        # the test server never returns ranges, so they are faked here
+        tool = LDAPAdminTool(copy.deepcopy(config))
+        pages = {'member;range=2-*': {'member;range=2-*': ['c']}}
+        tool._lom.get_single = lambda dn, f, scope, attrs: (dn,
+                                                            pages[attrs[0]])
+        values = tool._ranged_values('cn=group', {'member;range=0-1':
+                                                  ['a', 'b']}, 'member')
+        self.assertEqual(values, ['a', 'b', 'c'])